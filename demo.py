@@ -1,11 +1,228 @@
-from copy import deepcopy
-from math import prod
-
 import numpy as np
 import netCDF4
 import dask.array as da
 
-from activestorage import Active
+try:
+    from activestorage import Active
+except ImportError:
+    # The active reduction components will be computed locally, by
+    # NetCDFArray._local_active_read
+    Active = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# Chunks smaller than this (in elements) are always reduced with
+# numpy in the local active fallback: below it the overhead of calling
+# into a compiled kernel outweighs the saved ufunc dispatch.
+_NUMBA_MIN_SIZE = 4096
+
+# Operation codes for `_reduce1d`
+_OP_CODES = {"min": 0, "max": 1, "sum": 2}
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _reduce1d(a, op_code):
+        """Reduce a 1-d array to a scalar with a compiled loop.
+
+        *op_code* selects the reduction, per `_OP_CODES`. The loop is
+        parallelised and vectorised by numba, avoiding the
+        Python-level ufunc dispatch of the equivalent numpy call.
+
+        """
+        n = a.size
+        if op_code == 0:
+            r = a[0]
+            for i in prange(n):
+                r = min(r, a[i])
+        elif op_code == 1:
+            r = a[0]
+            for i in prange(n):
+                r = max(r, a[i])
+        else:
+            r = 0.0
+            for i in prange(n):
+                r += a[i]
+
+        return r
+
+else:
+    _reduce1d = None
+
+
+def _local_reduce(array, op, axis, keepdims_shape):
+    """Reduce *array* in-process for the local active fallback.
+
+    A full reduction of a large floating-point array goes through the
+    compiled `_reduce1d` kernel when numba is available; everything
+    else uses the equivalent numpy reduction with ``keepdims=True``.
+
+    :Parameters:
+
+        array: `numpy.ndarray`
+
+        op: `str`
+            One of ``'min'``, ``'max'`` or ``'sum'``.
+
+        axis: `tuple` or `None`
+
+        keepdims_shape: `tuple`
+
+    :Returns:
+
+        `numpy.ndarray`
+
+    """
+    full = axis is None or len(axis) == array.ndim
+    if not full:
+        return getattr(np, op)(array, axis=axis, keepdims=True)
+
+    if (
+        _reduce1d is not None
+        and array.dtype.kind == "f"
+        and array.size >= _NUMBA_MIN_SIZE
+    ):
+        r = _reduce1d(np.ascontiguousarray(array).ravel(), _OP_CODES[op])
+        dtype = array.dtype
+    else:
+        # A full reduction produces a scalar, so reduce without
+        # keepdims and shape the one-element result directly. This
+        # skips the keepdims shape management inside numpy's
+        # reduction loop.
+        r = getattr(array, op)()
+        dtype = np.asarray(r).dtype
+
+    out = np.empty(keepdims_shape, dtype=dtype)
+    out.fill(r)
+    return out
+
+
+def _active_min(a, **kwargs):
+    """Chunk calculations for the minimum.
+
+    Assumes that the calculations have already been done,
+    i.e. that *a* is already the minimum.
+
+    This function is intended to be passed in to
+    `dask.array.reduction()` as the ``chunk`` parameter. Its
+    return signature must be the same as the non-active chunks
+    function that it is replacing.
+
+    Defined at module scope so that cloudpickle serialises a
+    reference to it by qualified name, rather than pickling it
+    through the class descriptor into every task.
+
+    :Parameters:
+
+        a: `dict`
+
+    :Returns:
+
+        `numpy.ndarray`
+            Currently set up to replace `dask.array.chunk.min`.
+
+    """
+    return a["min"]
+
+
+def _active_max(a, **kwargs):
+    """Chunk calculations for the maximum.
+
+    Assumes that the calculations have already been done,
+    i.e. that *a* is already the maximum.
+
+    This function is intended to be passed in to
+    `dask.array.reduction()` as the ``chunk`` parameter. Its
+    return signature must be consistent with that expected by the
+    functions of the ``aggregate`` and ``combine`` parameters.
+
+    Defined at module scope so that cloudpickle serialises a
+    reference to it by qualified name, rather than pickling it
+    through the class descriptor into every task.
+
+    :Parameters:
+
+        a: `dict`
+
+    :Returns:
+
+        `numpy.ndarray`
+            Currently set up to replace `dask.array.chunk.max`.
+
+    """
+    return a["max"]
+
+
+def _active_mean(a, **kwargs):
+    """Chunk calculations for the mean.
+
+    Assumes that the calculations have already been done,
+    i.e. that *a* is already the mean.
+
+    This function is intended to be passed in to
+    `dask.array.reduction()` as the ``chunk`` parameter. Its
+    return signature must be the same as the non-active chunks
+    function that it is replacing.
+
+    Defined at module scope so that cloudpickle serialises a
+    reference to it by qualified name, rather than pickling it
+    through the class descriptor into every task.
+
+    :Parameters:
+
+        a: `dict`
+
+    :Returns:
+
+        `dict`
+            Currently set up to replace
+            `dask.array.reductions.mean_chunk`
+
+    """
+    return {"n": a["n"], "total": a["sum"]}
+
+
+def _aggregate_mean(d):
+    """Aggregate the components of an active mean reduction.
+
+    The per-chunk counts and partial sums are stacked into a single
+    (2, N) array and reduced along the last axis, so both components
+    are summed in one ufunc dispatch rather than two.
+
+    :Parameters:
+
+        d: `dict`
+
+    :Returns:
+
+        `dict`
+
+    """
+    stacked = np.stack(
+        [np.asarray(d["n"]).ravel(), np.asarray(d["sum"]).ravel()]
+    )
+    red = stacked.sum(axis=1)
+    return {"n": red[0], "sum": red[1]}
+
+
+# Map each supported active storage operation to the function that
+# aggregates its reduction components, keyed by the same names as
+# `NetCDFArray._ACTIVE_OPS`. Built once at import time so that the
+# per-chunk aggregation is a single dict lookup rather than a branch
+# chain.
+_AGG = {
+    "min": lambda d: {"min": d["min"].min()},
+    "max": lambda d: {"max": d["max"].max()},
+    "mean": _aggregate_mean,
+}
 
 
 class NetCDFArray:
@@ -21,36 +238,103 @@ class NetCDFArray:
 
     """
 
-    def __init__(self, filename=None, ncvar=None, dtype=None, shape=None):
+    # Total bytes of chunk-aligned reads kept by `_cached_read`
+    _READ_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+    # The set of attributes is fixed and small, so __slots__ removes
+    # the per-instance __dict__ (one instance exists per actified
+    # reduction variant) and makes attribute access an offset rather
+    # than a dict lookup in the per-chunk read and aggregation paths.
+    __slots__ = (
+        "filename",
+        "ncvar",
+        "dtype",
+        "shape",
+        "ndim",
+        "size",
+        "_keepdims_shape",
+        "chunk_cache_size",
+        "split_every",
+        "_nc",
+        "_var",
+        "_memmap",
+        "_chunking",
+        "_read_cache",
+        "_active_storage_op",
+        "_op_axis",
+    )
+
+    def __init__(
+        self,
+        filename=None,
+        ncvar=None,
+        dtype=None,
+        shape=None,
+        chunk_cache_size=None,
+        split_every=8,
+    ):
         self.filename = filename
         self.ncvar = ncvar
         self.dtype = dtype
         self.shape = shape
         self.ndim = len(shape)
-        self.size = prod(shape)
+        self.size = (
+            1 if not shape else int(np.multiply.reduce(shape, dtype=np.int64))
+        )
+        self._keepdims_shape = (1,) * self.ndim
+        self.chunk_cache_size = chunk_cache_size
+
+        # Fan-in for the tree reduction of active partials. The
+        # actify integration passes this through as the split_every
+        # parameter of `dask.array.reduction`, bounding both the
+        # number of partials in flight and the cost of each combine
+        # step.
+        self.split_every = split_every
+        self._nc = None
+        self._var = None
+        self._memmap = None
+        self._chunking = None
+        self._read_cache = None
 
     def __getitem__(self, indices):
         if self.active_storage_op:
             # Active storage read. Returns a dictionary.
-            active = Active(self.filename, self.ncvar)
-            active.method = self.active_storage_op
-            active.components = True
+            if Active is None:
+                # The active storage library is not available, so
+                # compute the reduction components locally instead.
+                data = self._local_active_read(indices)
+            else:
+                active = Active(self.filename, self.ncvar)
+                active.method = self.active_storage_op
+                active.components = True
+                data = active[indices]
 
-            return active[indices]
+            return self.aggregate_active_reductions(data)
 
+        return self._read(indices)
+
+    def _read(self, indices):
         # Normal read by local client. Returns a numpy array.
         #
+        # The dataset is opened on the first read and kept open, so
+        # that the HDF5 file open and metadata parse are amortised
+        # over all of the chunk reads rather than being paid per
+        # chunk.
+        #
         # In production code groups, masks, string types, etc. will
         # need to be accounted for here.
-        try:
-            nc = netCDF4.Dataset(self.filename, "r")
-        except RuntimeError as error:
-            raise RuntimeError(f"{error}: {self.filename}")
+        if self._nc is None:
+            self._open()
+
+        if self._memmap is not None:
+            # The variable's bytes are mapped directly, so this is a
+            # copy-free view that the OS pages in on demand.
+            return self._memmap[indices]
 
-        data = nc.variables[self.ncvar][indices]
-        nc.close()
+        if self._chunking:
+            return self._cached_read(indices)
 
-        return data
+        return self._var[indices]
 
     def __repr__(self):
         return f"<{self.__class__.__name__}{self.shape}: {self}>"
@@ -58,104 +342,302 @@ class NetCDFArray:
     def __str__(self):
         return f"file={self.filename} {self.ncvar}"
 
-    def _active_chunk_functions(self):
+    def __del__(self):
+        self.close()
+
+    def __getstate__(self):
+        # Don't serialize the open dataset handle or the memory map.
+        # They will be recreated lazily on the next read, e.g. after
+        # the object has been sent to a dask worker.
         return {
-            "min": self.active_min,
-            "max": self.active_max,
-            "mean": self.active_mean,
+            attr: getattr(self, attr)
+            for attr in self.__slots__
+            if attr
+            not in ("_nc", "_var", "_memmap", "_chunking", "_read_cache")
+            and hasattr(self, attr)
         }
 
-    @property
-    def active_storage_op(self):
-        return getattr(self, "_active_storage_op", None)
+    def __setstate__(self, state):
+        for attr, value in state.items():
+            setattr(self, attr, value)
 
-    @active_storage_op.setter
-    def active_storage_op(self, value):
-        self._active_storage_op = value
+        self._nc = None
+        self._var = None
+        self._memmap = None
+        self._chunking = None
+        self._read_cache = None
 
-    @property
-    def op_axis(self):
-        return getattr(self, "_op_axis", None)
+    def _open(self):
+        """Open the netCDF dataset and configure it for reading.
 
-    @op_axis.setter
-    def op_axis(self, value):
-        self._op_axis = value
-
-    @staticmethod
-    def active_min(a, **kwargs):
-        """Chunk calculations for the minimum.
+        The open dataset is cached on the instance.
 
-        Assumes that the calculations have already been done,
-        i.e. that *a* is already the minimum.
+        :Returns:
 
-        This function is intended to be passed in to
-        `dask.array.reduction()` as the ``chunk`` parameter. Its
-        return signature must be the same as the non-active chunks
-        function that it is replacing.
+            `netCDF4.Dataset`
 
-        :Parameters:
+        """
+        try:
+            nc = netCDF4.Dataset(self.filename, "r")
+        except RuntimeError as error:
+            raise RuntimeError(f"{error}: {self.filename}")
 
-            a: `dict`
+        var = nc.variables[self.ncvar]
+
+        # This simplified class doesn't handle masking or
+        # scale/offset packing (see the class docstring), so read the
+        # raw data directly. This avoids allocating a MaskedArray
+        # (data plus mask buffer) per chunk, and keeps the downstream
+        # reductions out of the masked-array dispatch path. In
+        # production code any fill values would be applied once here,
+        # at the read boundary.
+        var.set_auto_maskandscale(False)
+
+        # chunking() returns a list of chunk sizes for a chunked
+        # NETCDF4-format variable, 'contiguous' for an unchunked one,
+        # and None for other data models (e.g. netCDF-3), which have
+        # no HDF5 chunk cache to tune.
+        chunking = var.chunking()
+        if chunking and chunking != "contiguous":
+            # Size the HDF5 chunk cache to hold the decompressed
+            # on-disk chunks touched by successive dask block reads,
+            # so that dask chunk boundaries that don't align with the
+            # on-disk chunks don't re-run the decompression for
+            # overlapping regions.
+            size = self.chunk_cache_size
+            if size is None:
+                size = 8 * self.dtype.itemsize * int(
+                    np.multiply.reduce(chunking, dtype=np.int64)
+                )
+
+            var.set_var_chunk_cache(
+                size=size, nelems=1009, preemption=0.75
+            )
+
+            self._chunking = chunking
+            self._read_cache = {}
+
+        self._nc = nc
+        # Cache the variable proxy so that each chunk read doesn't
+        # repeat the nc.variables dict lookup
+        self._var = var
+        self._memmap = self._open_memmap()
+        return nc
+
+    def _open_memmap(self):
+        """Try to map the variable's on-disk bytes directly.
+
+        An uncompressed, contiguous layout stores the variable's data
+        as a single byte range in the file, which can be viewed
+        through `numpy.memmap` without a read or copy through the
+        netCDF library; the OS pages in the touched extents on
+        demand. The byte offset is found with `h5py`, so this fast
+        path only applies to netCDF-4 (HDF5) files.
 
         :Returns:
 
-            `numpy.ndarray`
-                Currently set up to replace `dask.array.chunk.min`.
+            `numpy.memmap` or `None`
+                The mapped variable data, or `None` if the file or
+                variable layout is not suitable, in which case reads
+                fall back to the normal netCDF path.
 
         """
-        return a["min"]
+        if h5py is None:
+            return None
 
-    @staticmethod
-    def active_max(a, **kwargs):
-        """Chunk calculations for the maximum.
+        try:
+            with h5py.File(self.filename, "r") as f:
+                ds = f[self.ncvar]
+                if ds.chunks is not None or ds.compression is not None:
+                    return None
+
+                offset = ds.id.get_offset()
+                if offset is None:
+                    return None
+
+                return np.memmap(
+                    self.filename,
+                    dtype=ds.dtype,
+                    mode="r",
+                    offset=offset,
+                    shape=self.shape,
+                )
+        except (OSError, KeyError):
+            # Not an HDF5 file, or the variable can't be mapped
+            return None
+
+    def _cached_read(self, indices):
+        """Serve a slice from a cache of chunk-aligned reads.
+
+        The requested slices are expanded to the enclosing box of
+        on-disk chunks, which is read once and kept in a small
+        per-instance LRU cache; reads that fall inside an
+        already-cached box are served by slicing it in memory. This
+        turns many small reads that straddle on-disk chunk boundaries
+        into a few aligned ones, each of which amortises its HDF5
+        chunk-index lookup and decompression. The cache is capped at
+        `_READ_CACHE_MAX_BYTES` and dropped by `close`.
+
+        Indices that are not step-1 slices bypass the cache.
 
-        Assumes that the calculations have already been done,
-        i.e. that *a* is already the maximum.
+        :Parameters:
 
-        This function is intended to be passed in to
-        `dask.array.reduction()` as the ``chunk`` parameter. Its
-        return signature must be consistent with that expected by the
-        functions of the ``aggregate`` and ``combine`` parameters.
+            indices:
+
+        :Returns:
+
+            `numpy.ndarray`
+
+        """
+        if not isinstance(indices, tuple):
+            indices = (indices,)
+
+        var = self._var
+        if len(indices) != self.ndim:
+            return var[indices]
+
+        box = []
+        inner = []
+        for index, c, n in zip(indices, self._chunking, self.shape):
+            if not isinstance(index, slice) or index.step not in (None, 1):
+                return var[indices]
+
+            start, stop, _ = index.indices(n)
+            b0 = (start // c) * c
+            b1 = min(-(-stop // c) * c, n)
+            box.append(slice(b0, b1))
+            inner.append(slice(start - b0, stop - b0))
+
+        key = tuple((index.start, index.stop) for index in box)
+        cache = self._read_cache
+        data = cache.pop(key, None)
+        if data is None:
+            data = var[tuple(box)]
+
+            # Evict least-recently-used boxes to stay under the cap
+            max_bytes = self._READ_CACHE_MAX_BYTES - data.nbytes
+            while cache and sum(d.nbytes for d in cache.values()) > max_bytes:
+                del cache[next(iter(cache))]
+
+        # (Re-)insertion marks the box as most recently used
+        cache[key] = data
+        return data[tuple(inner)]
+
+    def _local_active_read(self, indices):
+        """Compute the active storage reduction components locally.
+
+        Used in place of an `activestorage.Active` read when the
+        active storage library is not available. The returned
+        components have the same keys as an `Active` read with
+        ``components=True``, so the rest of the active path is
+        unchanged: the data is read normally and reduced in-process
+        by `_local_reduce`.
 
         :Parameters:
 
-            a: `dict`
+            indices:
 
         :Returns:
 
-            `numpy.ndarray`
-                Currently set up to replace `dask.array.chunk.max`.
+            `dict`
 
         """
-        return a["max"]
+        array = np.asarray(self._read(indices))
+        op = self.active_storage_op
+        axis = self.op_axis
+        keepdims_shape = self._keepdims_shape
+        if op == "mean":
+            # The count is only ever summed downstream, so a plain
+            # int avoids allocating an ndarray per chunk for it; the
+            # aggregation step coerces the components with np.asarray
+            # and reshapes only at the boundary.
+            return {
+                "n": int(array.size),
+                "sum": _local_reduce(array, "sum", axis, keepdims_shape),
+            }
+
+        return {op: _local_reduce(array, op, axis, keepdims_shape)}
+
+    def _active_chunk_functions(self):
+        return type(self)._ACTIVE_OPS
+
+    @property
+    def active_storage_op(self):
+        return getattr(self, "_active_storage_op", None)
+
+    @active_storage_op.setter
+    def active_storage_op(self, value):
+        self._active_storage_op = value
+
+    @property
+    def op_axis(self):
+        return getattr(self, "_op_axis", None)
+
+    @op_axis.setter
+    def op_axis(self, value):
+        self._op_axis = value
 
     @staticmethod
-    def active_mean(a, **kwargs):
-        """Chunk calculations for the mean.
+    def active_min(a, **kwargs):
+        """Alias for `_active_min`, kept for backwards compatibility."""
+        return _active_min(a, **kwargs)
 
-        Assumes that the calculations have already been done,
-        i.e. that *a* is already the mean.
+    @staticmethod
+    def active_max(a, **kwargs):
+        """Alias for `_active_max`, kept for backwards compatibility."""
+        return _active_max(a, **kwargs)
 
-        This function is intended to be passed in to
-        `dask.array.reduction()` as the ``chunk`` parameter. Its
-        return signature must be the same as the non-active chunks
-        function that it is replacing.
+    @staticmethod
+    def active_mean(a, **kwargs):
+        """Alias for `_active_mean`, kept for backwards compatibility."""
+        return _active_mean(a, **kwargs)
+
+    # Map each supported active storage operation to its chunk
+    # function. Built once at class definition time so that the
+    # per-chunk validation and lookup don't allocate a new dict and
+    # bound methods on every call.
+    _ACTIVE_OPS = {
+        "min": _active_min,
+        "max": _active_max,
+        "mean": _active_mean,
+    }
+
+    def aggregate_active_reductions(self, data):
+        """Aggregate the components of an active storage reduction.
+
+        Each component returned by the active storage operation is
+        reduced to a single value and reshaped to have the same
+        number of dimensions as the variable, each with size 1, as
+        expected by the `dask.array.reduction` chunk function that
+        will consume it. The reshape of a size-1 array is a zero-copy
+        view.
 
         :Parameters:
 
-            a: `dict`
+            data: `dict`
 
         :Returns:
 
             `dict`
-                Currently set up to replace
-                `dask.array.reductions.mean_chunk`
 
         """
-        return {"n": a["n"], "total": a["sum"]}
+        fn = _AGG.get(self.active_storage_op)
+        if fn is None:
+            raise ValueError(
+                "Can't aggregate components for active storage "
+                f"operation: {self.active_storage_op!r}"
+            )
+
+        data = fn(data)
+
+        keepdims_shape = self._keepdims_shape
+        return {
+            key: np.asarray(d).reshape(keepdims_shape)
+            for key, d in data.items()
+        }
 
     def set_active_storage_op(self, op, axis=None):
-        if op not in self._active_chunk_functions():
+        if op not in type(self)._ACTIVE_OPS:
             raise ValueError(f"Invalid active storage operation: {op!r}")
 
         a = self.copy()
@@ -164,13 +646,50 @@ class NetCDFArray:
         return a
 
     def get_active_chunk_function(self):
-        try:
-            return self._active_chunk_functions()[self.active_storage_op]
-        except KeyError:
-            raise ValueError("no active storage operation has been set")
+        # With only three operations an inline branch chain beats a
+        # dict lookup, and this runs once per chunk during graph
+        # construction
+        op = self.active_storage_op
+        if op == "min":
+            return _active_min
+        elif op == "max":
+            return _active_max
+        elif op == "mean":
+            return _active_mean
+
+        raise ValueError("no active storage operation has been set")
 
     def copy(self):
-        return deepcopy(self)
+        # All attributes are immutable or safely sharable, so a
+        # shallow copy suffices and avoids the deepcopy/pickle
+        # machinery that would otherwise run once per actified chunk.
+        new = object.__new__(type(self))
+        for attr in self.__slots__:
+            try:
+                setattr(new, attr, getattr(self, attr))
+            except AttributeError:
+                pass
+
+        # The copy gets its own dataset handle and memory map, so
+        # that closing one instance can't invalidate reads on
+        # another.
+        new._nc = None
+        new._var = None
+        new._memmap = None
+        new._chunking = None
+        new._read_cache = None
+        return new
+
+    def close(self):
+        """Close the cached netCDF dataset handle and memory map."""
+        self._var = None
+        self._memmap = None
+        self._chunking = None
+        self._read_cache = None
+        nc = getattr(self, "_nc", None)
+        if nc is not None:
+            self._nc = None
+            nc.close()
 
 
 if __name__ == "__main__":